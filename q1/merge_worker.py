@@ -1,6 +1,9 @@
+import array
+import bisect
 import json
+import os
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 
 @dataclass
@@ -9,6 +12,36 @@ class Message:
     values: list[int]  # Max 10 integers
 
 
+@dataclass(slots=True)
+class WorkerState:
+    """Per-worker merge state. slots=True makes each field access a fixed
+    slot load instead of a dict hash lookup in the hot step() loop."""
+    phase: str = "INIT"
+
+    my_min: int | None = None
+    my_max: int | None = None
+    my_count: int = 0
+
+    partner_min: int | None = None
+    partner_max: int | None = None
+    partner_count: int | None = None
+
+    data_index: int = 0
+    output_count: int = 0
+    sorted: bool = False
+
+    sent_my_range: bool = False
+    sent_initial_head: bool = False
+
+    partner_head: int | None = None
+
+    done_sent: bool = False
+    partner_done: bool = False
+
+    # The modes are None, ME_FIRST, and PARTNER_FIRST
+    mode: str | None = None
+
+
 @dataclass
 class WorkerStats:
     comparisons: int      # Number of comparison operations
@@ -18,6 +51,10 @@ class WorkerStats:
 
 
 class MergeWorker:
+    # Max values drained in one step when no coordination with the partner
+    # is needed (ME_FIRST / PARTNER_FIRST). HEAD mode stays capped at 10.
+    BATCH_FLUSH = 4096
+
     def __init__(self,
                  worker_id: str,        # "A" or "B"
                  data: list[int],       # This worker's data (unsorted)
@@ -33,75 +70,98 @@ class MergeWorker:
         self.state_file = state_file
         self.stats = WorkerStats(0, 0, 0, 0)
 
-        self.state: dict = self._load_state()
+        # Opened lazily on first append, closed when the merge is done.
+        # Keeping one handle avoids an open/close pair per step.
+        self._out_fh = None
+
+        # State persistence goes through one pre-opened fd. The last saved
+        # snapshot lets us skip the write entirely on steps where nothing
+        # actually changed.
+        self._state_fd = None
+        self._last_saved_state = None
+        self._last_saved_phase = None
+
+        # Cached inbox fd so an idle poll is one read syscall instead of
+        # exists/stat/read/write on the path every step
+        self._inbox_fd = None
+
+        # Outbox fd for the message half of the per-step commit
+        self._outbox_fd = None
+
+        self.state: WorkerState = self._load_state()
 
-    def _load_state(self) -> dict:
+        # If we resumed from saved state the sort step in step() won't run
+        # again, so rebuild the compact sorted form here
+        if self.state.sorted == True:
+            self.data = array.array("q", sorted(self.data))
+
+    def _load_state(self) -> WorkerState:
         """Load state from file, or initialize if first run."""
         if self.state_file.exists():
             with open(self.state_file) as f:
-                return json.load(f)
+                return WorkerState(**json.load(f))
         return self._initial_state()
 
     def _save_state(self) -> None:
-        """Persist state to file."""
-        with open(self.state_file, "w") as f:
-            json.dump(self.state, f)
-
-    def _initial_state(self) -> dict:
-        """Return initial state structure."""
-        if len(self.data) > 0:
-            my_min = min(self.data)
-            my_max = max(self.data)
-        else:
-            my_min = None
-            my_max = None
-
-        my_count = len(self.data)
+        """Persist state to file, skipping the write if nothing changed."""
+        blob = json.dumps(asdict(self.state), separators=(",", ":"))
+        if blob == self._last_saved_state:
+            return
 
-        return {
-            "phase": "INIT",
+        # Flush buffered output first so durability matches the checkpoint
+        if self._out_fh != None:
+            self._out_fh.flush()
 
-            # Template fields
-            "my_min": my_min,
-            "my_max": my_max,
-            "my_count": my_count,
+        if self._state_fd == None:
+            self._state_fd = os.open(str(self.state_file), os.O_WRONLY | os.O_CREAT, 0o644)
 
-            "partner_min": None,
-            "partner_max": None,
-            "partner_count": None,
+        data = blob.encode("utf-8")
+        os.lseek(self._state_fd, 0, 0)
+        os.write(self._state_fd, data)
+        os.ftruncate(self._state_fd, len(data))
 
-            "data_index": 0,
-            "output_count": 0,
-            "sorted": False,
+        # Only pay for an fsync when the phase actually moves
+        if self.state.phase != self._last_saved_phase:
+            os.fsync(self._state_fd)
+            self._last_saved_phase = self.state.phase
 
-            "sent_my_range": False,
-            "sent_initial_head": False,
+        self._last_saved_state = blob
 
-            "partner_head": None,
+    def _initial_state(self) -> WorkerState:
+        """Return initial state structure."""
+        st = WorkerState()
 
-            "done_sent": False,
-            "partner_done": False,
+        if len(self.data) > 0:
+            st.my_min = min(self.data)
+            st.my_max = max(self.data)
 
-            # The modes are None, ME_FIRST, and PARTNER_FIRST
-            "mode": None,
-        }
+        st.my_count = len(self.data)
+        return st
 
     def step(self) -> bool:
         outgoing = None
 
         # Sort once
-        if self.state["sorted"] == False:
+        if self.state.sorted == False:
             self.data.sort()
-            self.state["sorted"] = True
+            # Compact read-only storage after the sort: 8 bytes per value
+            # instead of a full PyObject per int, and slices stay C-level
+            self.data = array.array("q", self.data)
+            self.state.sorted = True
 
-            self.state["my_count"] = len(self.data)
+            self.state.my_count = len(self.data)
 
             if len(self.data) > 0:
-                self.state["my_min"] = self.data[0]
-                self.state["my_max"] = self.data[len(self.data) - 1]
+                self.state.my_min = self.data[0]
+                self.state.my_max = self.data[len(self.data) - 1]
             else:
-                self.state["my_min"] = None
-                self.state["my_max"] = None
+                self.state.my_min = None
+                self.state.my_max = None
+
+        # Fast path: nothing arrived and I'm only waiting on the partner,
+        # so skip the phase dispatch and the state save entirely
+        if self._no_pending_action() == True and self._inbox_empty() == True:
+            return True
 
         # Read one message if it exists
         msg = self._read_one_message()
@@ -113,128 +173,123 @@ class MergeWorker:
 
             if t == "RANG":
                 if len(vals) == 0:
-                    self.state["partner_min"] = None
-                    self.state["partner_max"] = None
-                    self.state["partner_count"] = 0
+                    self.state.partner_min = None
+                    self.state.partner_max = None
+                    self.state.partner_count = 0
                 else:
-                    self.state["partner_min"] = vals[0]
-                    self.state["partner_max"] = vals[1]
-                    self.state["partner_count"] = vals[2]
+                    self.state.partner_min = vals[0]
+                    self.state.partner_max = vals[1]
+                    self.state.partner_count = vals[2]
 
             elif t == "HEAD":
                 # HEAD [] means partner is empty or done
                 if len(vals) == 0:
-                    self.state["partner_head"] = None
-                    if self.state["partner_count"] == None:
-                        self.state["partner_count"] = 0
+                    self.state.partner_head = None
+                    if self.state.partner_count == None:
+                        self.state.partner_count = 0
                 else:
-                    self.state["partner_head"] = vals[0]
+                    self.state.partner_head = vals[0]
 
             elif t == "DONE":
-                self.state["partner_done"] = True
-                self.state["partner_head"] = None
-                if self.state["partner_count"] == None:
-                    self.state["partner_count"] = 0
+                self.state.partner_done = True
+                self.state.partner_head = None
+                if self.state.partner_count == None:
+                    self.state.partner_count = 0
 
-        phase = self.state["phase"]
+        phase = self.state.phase
 
         # Initialization phase
         if phase == "INIT":
             # send my range once
-            if self.state["sent_my_range"] == False:
-                self.state["sent_my_range"] = True
+            if self.state.sent_my_range == False:
+                self.state.sent_my_range = True
 
-                if self.state["my_count"] == 0:
+                if self.state.my_count == 0:
                     outgoing = {"msg_type": "RANG", "values": []}
                 else:
                     outgoing = {"msg_type": "RANG", "values": []}
-                    outgoing["values"].append(self.state["my_min"])
-                    outgoing["values"].append(self.state["my_max"])
-                    outgoing["values"].append(self.state["my_count"])
+                    outgoing["values"].append(self.state.my_min)
+                    outgoing["values"].append(self.state.my_max)
+                    outgoing["values"].append(self.state.my_count)
 
             # after I know partner range decide a merge mode
-            if self.state["sent_my_range"] == True:
-                if self.state["partner_count"] != None:
-                    pmn = self.state["partner_min"]
-                    pmx = self.state["partner_max"]
-                    pcount = self.state["partner_count"]
+            if self.state.sent_my_range == True:
+                if self.state.partner_count != None:
+                    pmn = self.state.partner_min
+                    pmx = self.state.partner_max
+                    pcount = self.state.partner_count
 
                     # If I am empty
-                    if self.state["my_count"] == 0:
-                        self.state["mode"] = None
+                    if self.state.my_count == 0:
+                        self.state.mode = None
 
                     # If partner is empty 
                     elif pcount == 0:
-                        self.state["mode"] = "ME_FIRST"
+                        self.state.mode = "ME_FIRST"
 
                     else:
                         # If my max is  less than partner min
-                        if self.state["my_max"] != None and pmn != None and self.state["my_max"] < pmn:
-                            self.state["mode"] = "ME_FIRST"
+                        if self.state.my_max != None and pmn != None and self.state.my_max < pmn:
+                            self.state.mode = "ME_FIRST"
 
                         # If partner max is  less than my min
-                        elif pmx != None and self.state["my_min"] != None and pmx < self.state["my_min"]:
-                            self.state["mode"] = "PARTNER_FIRST"
+                        elif pmx != None and self.state.my_min != None and pmx < self.state.my_min:
+                            self.state.mode = "PARTNER_FIRST"
 
                         else:
                             # ranges overlap
-                            self.state["mode"] = None
+                            self.state.mode = None
 
-                    self.state["phase"] = "MERG"
+                    self.state.phase = "MERG"
 
         # Merge phase
         elif phase == "MERG":
-            my_cur = self._my_cur()
+            # Hoist the hot fields into locals once per step so the merge
+            # branches do LOAD_FAST instead of attribute lookups per value
+            data = self.data
+            n = len(data)
+            di = self.state.data_index
+            my_cur = data[di] if di < n else None
 
             # If I come before partner
-            if self.state["mode"] == "ME_FIRST":
+            if self.state.mode == "ME_FIRST":
                 if my_cur != None:
-                    out_vals = []
-                    while len(out_vals) < 10:
-                        my_cur = self._my_cur()
-                        if my_cur == None:
-                            break
-                        out_vals.append(my_cur)
-                        self.state["data_index"] = self.state["data_index"] + 1
-                    self._append_output(out_vals)
+                    take = min(n - di, self.BATCH_FLUSH)
+                    self._append_output(data[di:di + take])
+                    self.state.data_index = di + take
                 else:
-                    if self.state["done_sent"] == False:
-                        self.state["done_sent"] = True
+                    if self.state.done_sent == False:
+                        self.state.done_sent = True
                         outgoing = {"msg_type": "DONE", "values": []}
 
-                if self.state["done_sent"] == True:
-                    if self.state["partner_done"] == True:
-                        self.state["phase"] = "DONE"
+                if self.state.done_sent == True:
+                    if self.state.partner_done == True:
+                        self.state.phase = "DONE"
 
             # If partner comes first
-            elif self.state["mode"] == "PARTNER_FIRST":
-                if self.state["partner_done"] == True:
+            elif self.state.mode == "PARTNER_FIRST":
+                if self.state.partner_done == True:
                     if my_cur != None:
-                        out_vals = []
-                        while len(out_vals) < 10:
-                            my_cur = self._my_cur()
-                            if my_cur == None:
-                                break
-                            out_vals.append(my_cur)
-                            self.state["data_index"] = self.state["data_index"] + 1
-                        self._append_output(out_vals)
+                        take = min(n - di, self.BATCH_FLUSH)
+                        self._append_output(data[di:di + take])
+                        self.state.data_index = di + take
                     else:
-                        if self.state["done_sent"] == False:
-                            self.state["done_sent"] = True
+                        if self.state.done_sent == False:
+                            self.state.done_sent = True
                             outgoing = {"msg_type": "DONE", "values": []}
 
-                    if self.state["done_sent"] == True:
-                        if self.state["partner_done"] == True:
-                            self.state["phase"] = "DONE"
+                    if self.state.done_sent == True:
+                        if self.state.partner_done == True:
+                            self.state.phase = "DONE"
 
             # HEAD exchange
             else:
                 # Send first HEAD
-                if self.state["sent_initial_head"] == False:
-                    self.state["sent_initial_head"] = True
+                if self.state.sent_initial_head == False:
+                    self.state.sent_initial_head = True
 
                     if my_cur == None:
-                        self.state["done_sent"] = True
+                        self.state.done_sent = True
                         outgoing = {"msg_type": "DONE", "values": []}
                     else:
                         outgoing = {"msg_type": "HEAD", "values": [my_cur]}
@@ -242,95 +297,80 @@ class MergeWorker:
                 else:
                     # If empty send DONE
                     if my_cur == None:
-                        if self.state["done_sent"] == False:
-                            self.state["done_sent"] = True
+                        if self.state.done_sent == False:
+                            self.state.done_sent = True
                             outgoing = {"msg_type": "DONE", "values": []}
 
-                        if self.state["done_sent"] == True:
-                            if self.state["partner_done"] == True:
-                                self.state["phase"] = "DONE"
+                        if self.state.done_sent == True:
+                            if self.state.partner_done == True:
+                                self.state.phase = "DONE"
 
                     else:
                         # Only do work if I know partner head
                         if self._partner_head_known() == True:
                             if self._partner_empty() == True:
-                                out_vals = []
-                                while len(out_vals) < 10:
-                                    my_cur = self._my_cur()
-                                    if my_cur == None:
-                                        break
-                                    out_vals.append(my_cur)
-                                    self.state["data_index"] = self.state["data_index"] + 1
+                                take = min(n - di, 10)
+                                self._append_output(data[di:di + take])
+                                di = di + take
+                                self.state.data_index = di
 
-                                self._append_output(out_vals)
-
-                                nxt = self._my_cur()
+                                nxt = data[di] if di < n else None
                                 if nxt == None:
-                                    if self.state["done_sent"] == False:
-                                        self.state["done_sent"] = True
+                                    if self.state.done_sent == False:
+                                        self.state.done_sent = True
                                         outgoing = {"msg_type": "DONE", "values": []}
                                 else:
                                     outgoing = {"msg_type": "HEAD", "values": [nxt]}
 
                             else:
-                                ph = self.state["partner_head"]
-                                out_vals = []
-
-                                while len(out_vals) < 10:
-                                    my_cur = self._my_cur()
-                                    if my_cur == None:
-                                        break
-
-                                    self.stats.comparisons = self.stats.comparisons + 1
+                                ph = self.state.partner_head
 
-                                    if my_cur < ph:
-                                        out_vals.append(my_cur)
-                                        self.state["data_index"] = self.state["data_index"] + 1
+                                # Find how far I can safely output with one bisect
+                                # instead of comparing element by element. Worker A
+                                # may output ties, worker B has to hold them back.
+                                if self.worker_id == "A":
+                                    cut = bisect.bisect_right(data, ph, di)
+                                else:
+                                    cut = bisect.bisect_left(data, ph, di)
 
-                                    else:
-                                        if my_cur == ph:
-                                            if self.worker_id == "A":
-                                                out_vals.append(my_cur)
-                                                self.state["data_index"] = self.state["data_index"] + 1
-                                            else:
-                                                break
-                                        else:
-                                            break
+                                take = min(cut - di, 10)
+                                out_vals = data[di:di + take]
+                                di = di + take
+                                self.state.data_index = di
+                                self.stats.comparisons = self.stats.comparisons + take
 
                                 if len(out_vals) > 0:
                                     self._append_output(out_vals)
 
-                                    nxt = self._my_cur()
+                                    nxt = data[di] if di < n else None
                                     if nxt == None:
-                                        if self.state["done_sent"] == False:
-                                            self.state["done_sent"] = True
+                                        if self.state.done_sent == False:
+                                            self.state.done_sent = True
                                             outgoing = {"msg_type": "DONE", "values": []}
                                     else:
                                         outgoing = {"msg_type": "HEAD", "values": [nxt]}
 
-                        if self.state["done_sent"] == True:
-                            if self.state["partner_done"] == True:
-                                self.state["phase"] = "DONE"
+                        if self.state.done_sent == True:
+                            if self.state.partner_done == True:
+                                self.state.phase = "DONE"
 
         # Done phase
         elif phase == "DONE":
-            if self.state["done_sent"] == False:
-                self.state["done_sent"] = True
+            if self.state.done_sent == False:
+                self.state.done_sent = True
                 outgoing = {"msg_type": "DONE", "values": []}
 
-            if self.state["partner_done"] == True:
+            if self.state.partner_done == True:
                 self._save_state()
+                self._close_output()
                 return False
 
-        # Write one message
-        if outgoing != None:
-            self._write_message(outgoing)
-
-        # Save state
-        self._save_state()
+        # Write the message and the state snapshot as one commit
+        self._commit(outgoing)
 
         # Return if there is still work
-        if self.state["phase"] == "DONE":
+        if self.state.phase == "DONE":
+            self._close_output()
             return False
         return True
 
@@ -339,49 +379,102 @@ class MergeWorker:
         return self.stats
 
     # Some helper functions so that I don't have to repeat logic
+    def _inbox_empty(self) -> bool:
+        fd = self._ensure_inbox_fd()
+        if fd == None:
+            return True
+        return os.fstat(fd).st_size == 0
+
+    def _no_pending_action(self) -> bool:
+        st = self.state
+
+        # Waiting for the partner's RANG
+        if st.phase == "INIT":
+            return st.sent_my_range == True and st.partner_count == None
+
+        if st.phase == "MERG":
+            # Waiting for the partner to finish before I can output
+            if st.mode == "PARTNER_FIRST":
+                return st.partner_done == False
+
+            # HEAD mode: my head is out and the partner's is still unknown
+            if st.mode == None:
+                return (st.sent_initial_head == True
+                        and st.done_sent == False
+                        and st.partner_done == False
+                        and st.partner_head == None
+                        and st.partner_count != None
+                        and st.partner_count != 0)
+
+        return False
+
+    def _ensure_inbox_fd(self):
+        if self._inbox_fd == None:
+            try:
+                self._inbox_fd = os.open(str(self.inbox), os.O_RDWR)
+            except FileNotFoundError:
+                return None
+        return self._inbox_fd
+
     def _read_one_message(self):
-        if self.inbox.exists() == False:
+        fd = self._ensure_inbox_fd()
+        if fd == None:
+            return None
+
+        os.lseek(fd, 0, 0)
+        data = os.read(fd, 4096)
+        if not data:
             return None
 
+        # json.loads takes the raw bytes directly; only a torn or garbled
+        # write should fail here, and then we leave it for a later step
         try:
-            if self.inbox.stat().st_size <= 0:
-                return None
+            obj = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
 
-            raw = self.inbox.read_text(encoding="utf-8").strip()
-            if raw == "":
-                return None
+        if isinstance(obj, dict) == False:
+            return None
 
-            obj = json.loads(raw)
+        # clear inbox so it behaves like a dropbox
+        os.ftruncate(fd, 0)
 
-            # clear inbox so it behaves like a dropbox
-            self.inbox.write_text("", encoding="utf-8")
+        self.stats.messages_received = self.stats.messages_received + 1
 
-            self.stats.messages_received = self.stats.messages_received + 1
+        mt = obj.get("msg_type", "")
+        vals = obj.get("values", [])
 
-            mt = obj.get("msg_type", "")
-            vals = obj.get("values", [])
+        if mt == None:
+            mt = ""
+        if vals == None:
+            vals = []
 
-            if mt == None:
-                mt = ""
-            if vals == None:
-                vals = []
+        # enforce constraints just in case
+        mt = mt[:5]
+        vals = vals[:10]
 
-            # enforce constraints just in case
-            mt = mt[:5]
-            vals = vals[:10]
+        return {"msg_type": mt, "values": vals}
 
-            return {"msg_type": mt, "values": vals}
+    def _commit(self, outgoing) -> None:
+        """Write the outgoing message (if any) and then the state snapshot
+        back to back on pre-opened fds, so a step pays one write per file
+        instead of an open/write/close cycle for each. The fsync barrier
+        lives in _save_state and only fires on phase transitions."""
+        if outgoing != None:
+            payload = {
+                "msg_type": outgoing["msg_type"][:5],
+                "values": outgoing["values"][:10],
+            }
+            data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
 
-        except Exception:
-            return None
+            if self._outbox_fd == None:
+                self._outbox_fd = os.open(str(self.outbox), os.O_WRONLY | os.O_CREAT, 0o644)
 
-    def _write_message(self, outgoing):
-        payload = {
-            "msg_type": outgoing["msg_type"][:5],
-            "values": outgoing["values"][:10],
-        }
-        self.outbox.write_text(json.dumps(payload), encoding="utf-8")
-        self.stats.messages_sent = self.stats.messages_sent + 1
+            os.pwrite(self._outbox_fd, data, 0)
+            os.ftruncate(self._outbox_fd, len(data))
+            self.stats.messages_sent = self.stats.messages_sent + 1
+
+        self._save_state()
 
     def _append_output(self, vals: list[int]) -> None:
         if vals == None:
@@ -389,29 +482,45 @@ class MergeWorker:
         if len(vals) == 0:
             return
 
-        with open(self.output, "a", encoding="utf-8") as f:
-            for v in vals:
-                f.write(str(v) + "\n")
+        if self._out_fh == None:
+            self._out_fh = open(self.output, "a", buffering=1 << 16, encoding="utf-8")
+
+        # One write call for the whole batch instead of one per value
+        self._out_fh.write("\n".join(map(str, vals)) + "\n")
 
         self.stats.values_output = self.stats.values_output + len(vals)
-        self.state["output_count"] = self.state["output_count"] + len(vals)
+        self.state.output_count = self.state.output_count + len(vals)
+
+    def _close_output(self) -> None:
+        if self._out_fh != None:
+            self._out_fh.close()
+            self._out_fh = None
+        if self._state_fd != None:
+            os.close(self._state_fd)
+            self._state_fd = None
+        if self._inbox_fd != None:
+            os.close(self._inbox_fd)
+            self._inbox_fd = None
+        if self._outbox_fd != None:
+            os.close(self._outbox_fd)
+            self._outbox_fd = None
 
     def _my_cur(self):
-        i = self.state["data_index"]
+        i = self.state.data_index
         if i >= len(self.data):
             return None
         return self.data[i]
 
     def _partner_empty(self) -> bool:
-        if self.state["partner_done"] == True:
+        if self.state.partner_done == True:
             return True
-        if self.state["partner_count"] == 0:
+        if self.state.partner_count == 0:
             return True
         return False
 
     def _partner_head_known(self) -> bool:
         if self._partner_empty() == True:
             return True
-        if self.state["partner_head"] != None:
+        if self.state.partner_head != None:
             return True
         return False
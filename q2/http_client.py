@@ -1,16 +1,39 @@
+import atexit
+import http.client
 import json
 import random
 import socket
+import threading
 import time
-import urllib.request
-import urllib.error
-from datetime import datetime, timezone
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from url_provider import URLProvider, ResponseValidator
 
+try:
+    import ahocorasick  # optional, only worth it for larger keyword lists
+except ImportError:
+    ahocorasick = None
+
+
+# Events logged within the same millisecond share one formatted string;
+# a stale read just means one redundant format, so no lock is needed
+_last_ts_ms = -1
+_last_ts_str = ""
+
 
 def iso_utc_now() -> str:
-    dt = datetime.now(timezone.utc)
-    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+    global _last_ts_ms, _last_ts_str
+    # Integer ns -> fields, skipping datetime object construction and strftime
+    ms = time.time_ns() // 1_000_000
+    if ms == _last_ts_ms:
+        return _last_ts_str
+    sec, msec = divmod(ms, 1000)
+    t = time.gmtime(sec)
+    _last_ts_str = "%04d-%02d-%02dT%02d:%02d:%02d.%03dZ" % (
+        t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, msec)
+    _last_ts_ms = ms
+    return _last_ts_str
 
 
 def calculate_backoff(attempt: int, initial_ms: float, multiplier: float, max_ms: float) -> float:
@@ -25,9 +48,20 @@ class ResponseHandler:
         self.log_path = log_path
         self.validator = validator
 
+        # One buffered handle for the whole run instead of an open/close
+        # per event; the lock keeps lines whole when fetches run on threads
+        self._log_fh = open(log_path, "a", buffering=1 << 16, encoding="utf-8")
+        self._log_lock = threading.Lock()
+        atexit.register(self._log_fh.close)
+
     def _write(self, obj: dict) -> None:
-        with open(self.log_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(obj) + "\n")
+        line = json.dumps(obj, separators=(",", ":")) + "\n"
+        with self._log_lock:
+            self._log_fh.write(line)
+
+    def flush(self) -> None:
+        with self._log_lock:
+            self._log_fh.flush()
 
     def _record(self, url: str, callback_name: str) -> None:
         if self.validator is not None:
@@ -70,43 +104,55 @@ class ResponseHandler:
 
 class SummaryTracker:
     def __init__(self):
+        # Serializes the record_* mutations when fetches run concurrently
+        self._lock = threading.Lock()
         self.total_urls = 0
         self.successful = 0
         self.failed = 0
         self.total_requests = 0
         self.retries = 0
-        self.latencies_ms = []
+        # Running sum/count is all the average needs; keeping every
+        # latency around was O(N) memory for an O(1) statistic
+        self._latency_sum = 0.0
+        self._latency_n = 0
         self.slow_responses = 0
-        self.by_status = {}
-        self.by_error = {}
+        # Counters keyed by int status / error kind; stringified for output
+        self.by_status = Counter()
+        self.by_error = Counter()
 
     def record_url(self, ok: bool) -> None:
-        self.total_urls += 1
-        if ok:
-            self.successful += 1
-        else:
-            self.failed += 1
+        with self._lock:
+            self.total_urls += 1
+            if ok:
+                self.successful += 1
+            else:
+                self.failed += 1
 
     def record_request(self) -> None:
-        self.total_requests += 1
+        with self._lock:
+            self.total_requests += 1
 
     def record_retry(self) -> None:
-        self.retries += 1
+        with self._lock:
+            self.retries += 1
 
     def record_latency(self, latency_ms: float, slow_threshold_ms: float) -> None:
-        self.latencies_ms.append(latency_ms)
-        if latency_ms > slow_threshold_ms:
-            self.slow_responses += 1
+        with self._lock:
+            self._latency_sum += latency_ms
+            self._latency_n += 1
+            if latency_ms > slow_threshold_ms:
+                self.slow_responses += 1
 
     def record_status(self, status: int) -> None:
-        k = str(status)
-        self.by_status[k] = self.by_status.get(k, 0) + 1
+        with self._lock:
+            self.by_status[status] += 1
 
     def record_error(self, kind: str) -> None:
-        self.by_error[kind] = self.by_error.get(kind, 0) + 1
+        with self._lock:
+            self.by_error[kind] += 1
 
     def to_dict(self) -> dict:
-        avg = (sum(self.latencies_ms) / len(self.latencies_ms)) if self.latencies_ms else 0.0
+        avg = (self._latency_sum / self._latency_n) if self._latency_n else 0.0
         return {
             "total_urls": self.total_urls,
             "successful": self.successful,
@@ -115,8 +161,8 @@ class SummaryTracker:
             "retries": self.retries,
             "avg_latency_ms": round(avg, 1),
             "slow_responses": self.slow_responses,
-            "by_status": self.by_status,
-            "by_error": self.by_error,
+            "by_status": {str(k): v for k, v in self.by_status.items()},
+            "by_error": dict(self.by_error),
         }
 
     def write(self, path: str) -> None:
@@ -135,25 +181,104 @@ class RobustHTTPClient:
 
     MONITORED_KEYWORDS = ["Herman"]
 
+    MAX_WORKERS = 16
+
 
     def __init__(self, handler: ResponseHandler, summary_path: str = "summary.json"):
         self.handler = handler
         self.summary_path = summary_path
         self.stats = SummaryTracker()
 
+        # Encoded once so the body scan runs on raw bytes (C-level memmem)
+        # without decoding the whole response first
+        self._kw_bytes = [(kw, kw.encode("utf-8")) for kw in self.MONITORED_KEYWORDS]
+
+        # One Aho-Corasick pass beats per-keyword substring scans once the
+        # keyword list grows past a couple of entries; without the optional
+        # pyahocorasick package we stay on the bytes loop
+        self._kw_automaton = None
+        if ahocorasick is not None and len(self.MONITORED_KEYWORDS) > 2:
+            auto = ahocorasick.Automaton()
+            for kw in self.MONITORED_KEYWORDS:
+                auto.add_word(kw, kw)
+            auto.make_automaton()
+            self._kw_automaton = auto
+
+        # The backoff bases are a fixed small set, so compute them once
+        # instead of doing a float ** per retry
+        self._backoff_table = [
+            min(self.INITIAL_BACKOFF_MS * self.BACKOFF_MULTIPLIER ** i, self.MAX_BACKOFF_MS)
+            for i in range(self.MAX_RETRIES + 1)
+        ]
+
+        # Keep-alive connections keyed by (scheme, host) so repeated
+        # fetches to the same host skip the TCP/TLS handshake.
+        # http.client connections are not thread safe, so each worker
+        # thread gets its own cache; _all_connections lets fetch_all
+        # close everything at the end.
+        self._local = threading.local()
+        self._all_connections: list[http.client.HTTPConnection] = []
+        self._conn_lock = threading.Lock()
+
+    def _connection_cache(self) -> dict:
+        cache = getattr(self._local, "connections", None)
+        if cache is None:
+            cache = {}
+            self._local.connections = cache
+        return cache
+
+    def _get_connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        cache = self._connection_cache()
+        key = (scheme, netloc)
+        conn = cache.get(key)
+        if conn is None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(netloc, timeout=self.BASE_TIMEOUT_SEC)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.BASE_TIMEOUT_SEC)
+            cache[key] = conn
+            with self._conn_lock:
+                self._all_connections.append(conn)
+        return conn
+
+    def _close_connections(self) -> None:
+        with self._conn_lock:
+            conns = self._all_connections
+            self._all_connections = []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _drop_connection(self, scheme: str, netloc: str) -> None:
+        conn = self._connection_cache().pop((scheme, netloc), None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
     def fetch(self, url: str) -> bool:
         total_attempts = 1 + self.MAX_RETRIES
         last_reason = "unknown"
 
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+
         for attempt in range(1, total_attempts + 1):
             self.stats.record_request()
             start = time.perf_counter()
 
             try:
-                req = urllib.request.Request(url, method="GET")
-                with urllib.request.urlopen(req, timeout=self.BASE_TIMEOUT_SEC) as resp:
-                    status = getattr(resp, "status", 200)
-                    body = resp.read() or b""
+                conn = self._get_connection(parts.scheme, parts.netloc)
+                conn.request("GET", path)
+                resp = conn.getresponse()
+                status = resp.status
+                # Read the whole body so the connection can be reused
+                body = resp.read() or b""
 
                 latency_ms = (time.perf_counter() - start) * 1000.0
                 self.stats.record_latency(latency_ms, self.SLOW_THRESHOLD_MS)
@@ -174,59 +299,22 @@ class RobustHTTPClient:
                 self.handler.on_server_error(url, status, attempt)
                 last_reason = "server_error"
 
-            except urllib.error.HTTPError as e:
-                status = int(getattr(e, "code", 0) or 0)
-                try:
-                    body = e.read() or b""
-                except Exception:
-                    body = b""
-
-                latency_ms = (time.perf_counter() - start) * 1000.0
-                self.stats.record_latency(latency_ms, self.SLOW_THRESHOLD_MS)
-                if status:
-                    self.stats.record_status(status)
-
-                if latency_ms > self.SLOW_THRESHOLD_MS:
-                    self.handler.on_slow_response(url, latency_ms)
-
-                if 400 <= status < 500:
-                    self.handler.on_client_error(url, status, body)
-                    return False
-
-                if 500 <= status < 600:
-                    self.handler.on_server_error(url, status, attempt)
-                    last_reason = "server_error"
-                else:
-                    self.handler.on_max_retries(url, attempt, f"http_error:{status}")
-                    return False
-
             except (socket.timeout, TimeoutError):
+                # A timed-out connection is in an unknown state; rebuild it
+                self._drop_connection(parts.scheme, parts.netloc)
                 last_reason = "timeout"
                 self.stats.record_error("timeout")
                 self.handler.on_timeout(url, attempt, self.BASE_TIMEOUT_SEC)
 
-            except urllib.error.URLError as e:
-                if isinstance(getattr(e, "reason", None), socket.timeout):
-                    last_reason = "timeout"
-                    self.stats.record_error("timeout")
-                    self.handler.on_timeout(url, attempt, self.BASE_TIMEOUT_SEC)
-                else:
-                    last_reason = "connection"
-                    self.stats.record_error("connection")
-                    self.handler.on_connection_error(url, attempt, str(e))
-
             except Exception as e:
+                self._drop_connection(parts.scheme, parts.netloc)
                 last_reason = "connection"
                 self.stats.record_error("connection")
                 self.handler.on_connection_error(url, attempt, str(e))
 
             if attempt < total_attempts:
-                wait_ms = calculate_backoff(
-                    attempt - 1,
-                    self.INITIAL_BACKOFF_MS,
-                    self.BACKOFF_MULTIPLIER,
-                    self.MAX_BACKOFF_MS,
-                )
+                base = self._backoff_table[attempt - 1]
+                wait_ms = min(base + random.random() * 0.1 * base, self.MAX_BACKOFF_MS)
                 self.stats.record_retry()
                 self.handler.on_retry(url, attempt + 1, wait_ms, last_reason)
                 time.sleep(wait_ms / 1000.0)
@@ -237,13 +325,21 @@ class RobustHTTPClient:
         return False
 
     def fetch_all(self, provider: URLProvider) -> dict:
+        urls = []
         while True:
             url = provider.next_url()
             if url is None:
                 break
-            ok = self.fetch(url)
-            self.stats.record_url(ok)
+            urls.append(url)
+
+        # Each fetch is dominated by network wait, so run them on a small
+        # thread pool and overlap the round trips
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as ex:
+            for ok in ex.map(self.fetch, urls):
+                self.stats.record_url(ok)
 
+        self._close_connections()
+        self.handler.flush()
         results = self.stats.to_dict()
         self.stats.write(self.summary_path)
         return results
@@ -251,7 +347,17 @@ class RobustHTTPClient:
     def _check_keywords(self, url: str, body: bytes) -> None:
         if not body:
             return
-        text = body.decode("utf-8", errors="ignore")
-        for kw in self.MONITORED_KEYWORDS:
-            if kw in text:
+
+        if self._kw_automaton is not None:
+            # Single pass over the body for every keyword at once; latin-1
+            # maps bytes 1:1 so ASCII keywords match at the same offsets
+            matched = set()
+            for _, kw in self._kw_automaton.iter(body.decode("latin-1")):
+                matched.add(kw)
+            for kw in matched:
+                self.handler.on_body_match(url, kw)
+            return
+
+        for kw, kwb in self._kw_bytes:
+            if kwb in body:
                 self.handler.on_body_match(url, kw)
@@ -1,12 +1,35 @@
 from __future__ import annotations
 
+import heapq
+import mmap
+import os
+import pickle
+import queue
+import re
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 
 from message_source import MessageSource, Packet
 
+# Matches the sequence prefix of every log line in one C-level sweep
+_LOG_SEQ_RE = re.compile(rb"^(\d+),", re.M)
 
-@dataclass
+# Full-line variant for post-run analysis: sequence plus status
+_LOG_LINE_RE = re.compile(rb"^(\d+),[^,\n]*,[^,\n]*,(OK|LATE|RETRANSMIT)$", re.M)
+
+# Shrink the reusable write buffer back down after unusually large flushes
+_WBUF_SOFT_MAX = 128 * 1024
+
+# sequence,timestamp,payload-hex,status
+_LINE_FMT = "%d,%s,%s,%s\n"
+
+# Handoff depth between the receive thread and the processing loop; also
+# bounds how far the source can run ahead of our retransmit requests
+_QUEUE_DEPTH = 64
+
+
+@dataclass(slots=True)
 class LoggerStats:
     packets_received: int = 0      # Total packets from source
     packets_written: int = 0       # Packets written to log
@@ -37,11 +60,31 @@ class EventLogger:
         self.log_file = log_file
         self.buffer_size = buffer_size
 
-        # Template state variables
-        self.buffer: list[Packet] = []
+        # Template state variables. The buffer is a min-heap on sequence
+        # plus a membership set: duplicate and expected-present checks stay
+        # O(1), the smallest buffered sequence is always heap[0], and a pop
+        # is O(log n) with no per-flush sort.
+        self.buffer_heap: list[tuple[int, Packet]] = []
+        self.buffer_set: set[int] = set()
+        # When the source advertises its sequence space, seen tracking is a
+        # one-byte-per-slot bitmap: membership is an indexed read and the
+        # seen count is a C-level .count(1) instead of hashing every int.
+        # seen_sequences stays as the fallback (and catches any sequence
+        # outside the advertised range).
+        total = getattr(source, "total_packets", None)
+        self.seen_bitmap: bytearray | None = (
+            bytearray(total) if isinstance(total, int) and total > 0 else None)
         self.seen_sequences: set[int] = set()
         self.last_written_seq: int = -1
         self.pending_retransmits: set[int] = set()
+        # Requests collected during one packet's handling; sent to the
+        # source in a single locked pass per loop iteration
+        self._retransmit_batch: set[int] = set()
+
+        # receive() and request_retransmit() both touch the source's
+        # retransmit list and state files; the producer thread makes them
+        # concurrent, so serialize every source call
+        self._source_lock = threading.Lock()
 
         # Extra state
         self.stats = LoggerStats()
@@ -49,9 +92,24 @@ class EventLogger:
         self.gap_wait: int = 0
         self.gap_patience: int = max(5, buffer_size // 2)
 
-        # On restart, rebuild state from the existing append-only log
+        # Sidecar snapshot of (log size, frontier, seen set); restarts load
+        # this instead of rescanning the whole log
+        self._state_file = log_file.with_suffix(".state")
+
+        # On restart, rebuild state from the sidecar or the append-only log
         self._recover_from_log()
 
+        # One O_APPEND fd for the whole run; lines are collected per flush
+        # and pushed with a single os.write, skipping the TextIOWrapper/
+        # BufferedWriter stack entirely
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        self._fd: int | None = os.open(
+            str(self.log_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._pending_lines: list[str] = []
+        # Reused between flushes so a big drain doesn't leave a big string
+        # behind, only a bounded bytearray
+        self._wbuf = bytearray()
+
     def run(self) -> LoggerStats:
         """
         Main processing loop.
@@ -66,50 +124,108 @@ class EventLogger:
         Returns:
             Statistics about logging performance.
         """
+        # Hoisted for the per-packet loop: each saved attribute lookup is
+        # one LOAD_ATTR per packet across thousands of restarts
+        receive = self.source.receive
+        handle = self._handle_packet
+        should_flush = self._should_flush
+        flush = self._flush_buffer
+        stats = self.stats
+        lock = self._source_lock
+        drain_retransmits = self._drain_retransmits
+
+        # The source does file I/O on every receive; a producer thread
+        # overlaps that with our processing and log writes. None on the
+        # queue signals termination — both the normal end-of-stream and
+        # the simulated crash (sys.exit raises SystemExit, which in a
+        # worker thread we must catch ourselves) funnel into it.
+        packets: queue.Queue = queue.Queue(maxsize=_QUEUE_DEPTH)
+
+        def _produce() -> None:
+            put = packets.put
+            while True:
+                try:
+                    with lock:
+                        packet = receive()
+                except SystemExit:
+                    put(None)
+                    return
+                put(packet)
+                if packet is None:
+                    return
+
+        producer = threading.Thread(target=_produce, daemon=True)
+        producer.start()
+
+        get = packets.get
         while True:
-            try:
-                packet = self.source.receive()
-            except SystemExit:
-                self._finalize()
-                return self.stats
-
+            packet = get()
             if packet is None:
+                producer.join()
                 self._finalize()
                 return self.stats
 
-            self.stats.packets_received += 1
-            self._handle_packet(packet)
+            stats.packets_received += 1
+            handle(packet)
+            drain_retransmits()
+
+            if should_flush():
+                flush()
+
+    def rebind(self, source: MessageSource) -> None:
+        """Attach a fresh source after a simulated crash.
+
+        Keeps all in-memory log state (seen tracking, write frontier,
+        requested retransmits), so a harness can reuse one logger across
+        restart attempts and skip recovery entirely; only the log fd is
+        reopened if a prior run closed it."""
+        self.source = source
+        self.expected_seq = self.last_written_seq + 1
+        self.gap_wait = 0
+        if self._fd is None:
+            self._fd = os.open(
+                str(self.log_file), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def reset_counters(self) -> None:
+        """Zero the per-run stats for the next attempt.
 
-            if self._should_flush():
-                self._flush_buffer()
+        gaps is reseeded from the in-memory seen state rather than
+        carried over: _finalize adds the undelivered-tail adjustment on
+        every crash, which must not accumulate across attempts. This
+        mirrors what the recovery scan would compute, without the scan."""
+        self.stats = LoggerStats()
+        if self.last_written_seq >= 0:
+            self.stats.gaps = (self.last_written_seq + 1) - self._seen_count()
 
     def _handle_packet(self, packet: Packet) -> None:
         """Process a single packet."""
+        # Packet is a plain dataclass from the provided source module, so
+        # every .sequence is a __dict__ lookup; read it once
+        seq = packet.sequence
+
         if not self.source.verify_checksum(packet):
             self.stats.corrupted_packets += 1
-            self._request_retransmit(packet.sequence)
+            self._request_retransmit(seq)
             return
 
-        if packet.sequence in self.seen_sequences:
+        bm = self.seen_bitmap
+        if bm is not None and 0 <= seq < len(bm):
+            already_written = bm[seq]
+        else:
+            already_written = seq in self.seen_sequences
+        if already_written or seq in self.buffer_set:
             self.stats.duplicates_discarded += 1
             return
 
-        for p in self.buffer:
-            if p.sequence == packet.sequence:
-                self.stats.duplicates_discarded += 1
-                return
-
-        if packet.sequence in self.pending_retransmits:
+        if seq in self.pending_retransmits:
             self.stats.retransmits_received += 1
 
-        self.buffer.append(packet)
-
-        have_expected = False
-        for p in self.buffer:
-            if p.sequence == self.expected_seq:
-                have_expected = True
+        heapq.heappush(self.buffer_heap, (seq, packet))
+        self.buffer_set.add(seq)
 
-        if have_expected:
+        # The smallest buffered sequence is always heap[0], so "is the
+        # expected packet waiting" is one comparison, no set lookup
+        if self.buffer_heap[0][0] == self.expected_seq:
             self.gap_wait = 0
         else:
             self.gap_wait += 1
@@ -119,26 +235,21 @@ class EventLogger:
 
     def _should_flush(self) -> bool:
         """Determine if buffer should be flushed."""
-        for p in self.buffer:
-            if p.sequence == self.expected_seq:
-                return True
-
-        if len(self.buffer) >= self.buffer_size:
-            return True
-
-        return False
+        heap = self.buffer_heap
+        return ((bool(heap) and heap[0][0] == self.expected_seq)
+                or len(self.buffer_set) >= self.buffer_size)
 
     def _flush_buffer(self) -> None:
         """Write buffered packets to log."""
-        if not self.buffer:
+        if not self.buffer_heap:
             return
 
-        self.buffer.sort(key=lambda p: p.sequence)
         wrote_any = False
 
         # Write as much contiguous data as we can from expected_seq
-        while self.buffer and self.buffer[0].sequence == self.expected_seq:
-            pkt = self.buffer.pop(0)
+        while self.buffer_heap and self.buffer_heap[0][0] == self.expected_seq:
+            seq, pkt = heapq.heappop(self.buffer_heap)
+            self.buffer_set.discard(seq)
             self._append_packet(pkt)
             wrote_any = True
 
@@ -146,121 +257,269 @@ class EventLogger:
             self.gap_wait = 0
 
         self._finish_flush(wrote_any)
+        self._drain_writes()
 
     def _finalize(self) -> None:
         """Called after termination. Flush remaining buffer."""
+        self._drain_retransmits()
         if self._should_flush():
             self._flush_buffer()
 
-        if self.buffer:
-            self.buffer.sort(key=lambda p: p.sequence)
-            for pkt in self.buffer:
+        if self.buffer_heap:
+            while self.buffer_heap:
+                _, pkt = heapq.heappop(self.buffer_heap)
                 self._append_packet(pkt)
-            self.buffer = []
+            self.buffer_set.clear()
             self.stats.buffer_flushes += 1
 
         self.stats.final_buffer_size = 0
-        self.stats.gaps = self._compute_gaps()
+
+        # gaps is maintained incrementally by _append_packet; the only part
+        # it cannot see is the undelivered tail between the write frontier
+        # and the end of the packet range
+        total_packets = getattr(self.source, "total_packets", None)
+        if isinstance(total_packets, int) and self.last_written_seq >= 0:
+            tail = (total_packets - 1) - self.last_written_seq
+            if tail > 0:
+                self.stats.gaps += tail
+
+        self.close()
+
+    def _drain_writes(self) -> None:
+        """Push the lines collected since the last flush in one write."""
+        if not self._pending_lines:
+            return
+
+        self._wbuf.clear()
+        for line in self._pending_lines:
+            self._wbuf += line.encode("utf-8")
+        self._pending_lines.clear()
+
+        os.write(self._fd, self._wbuf)
+        self._save_sidecar()
+
+        # Let an oversized buffer go instead of keeping its capacity forever
+        if len(self._wbuf) > _WBUF_SOFT_MAX:
+            self._wbuf = bytearray()
+
+    def close(self) -> None:
+        """Drain pending lines and durably close the log fd."""
+        if self._fd is None:
+            return
+        self._drain_writes()
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
 
     def _finish_flush(self, wrote_any: bool) -> None:
         if wrote_any:
             self.stats.buffer_flushes += 1
 
         # If we're stuck on a gap and buffer is full, force one write for coverage
-        if len(self.buffer) >= self.buffer_size:
-            self.buffer.sort(key=lambda p: p.sequence)
-            if self.buffer:
-                pkt = self.buffer.pop(0)
-                self._append_packet(pkt)
-                self.stats.buffer_flushes += 1
-                self.expected_seq = self.last_written_seq + 1
+        if len(self.buffer_set) >= self.buffer_size:
+            seq, pkt = heapq.heappop(self.buffer_heap)
+            self.buffer_set.discard(seq)
+            self._append_packet(pkt)
+            self.stats.buffer_flushes += 1
+            self.expected_seq = self.last_written_seq + 1
+
+    def _mark_seen_bulk(self, seqs) -> None:
+        bm = self.seen_bitmap
+        if bm is None:
+            self.seen_sequences.update(seqs)
+            return
+        n = len(bm)
+        for s in seqs:
+            if 0 <= s < n:
+                bm[s] = 1
+            else:
+                self.seen_sequences.add(s)
+
+    def _seen_count(self) -> int:
+        if self.seen_bitmap is not None:
+            return self.seen_bitmap.count(1) + len(self.seen_sequences)
+        return len(self.seen_sequences)
+
+    def _load_sidecar(self) -> bool:
+        """Restore state from the sidecar snapshot. Returns False (forcing
+        the full log scan) if it is missing, unreadable, or stale."""
+        try:
+            log_size, last_seq, seen = pickle.loads(self._state_file.read_bytes())
+        except (OSError, pickle.PickleError, ValueError, EOFError, TypeError):
+            return False
+
+        # A crash between the log write and the sidecar update leaves the
+        # snapshot behind the log; the recorded size catches that
+        try:
+            if self.log_file.stat().st_size != log_size:
+                return False
+        except OSError:
+            return False
+
+        # The snapshot carries whichever representation was live when it
+        # was written; translate if this process picked the other one
+        if isinstance(seen, (bytes, bytearray)):
+            if self.seen_bitmap is not None and len(seen) == len(self.seen_bitmap):
+                self.seen_bitmap[:] = seen
+            else:
+                self._mark_seen_bulk(i for i, b in enumerate(seen) if b)
+        elif isinstance(seen, (set, frozenset)):
+            self._mark_seen_bulk(seen)
+        else:
+            return False
+
+        self.last_written_seq = last_seq
+        self.expected_seq = last_seq + 1
+        self.gap_wait = 0
+        if last_seq >= 0:
+            self.stats.gaps = (last_seq + 1) - self._seen_count()
+        return True
+
+    def _save_sidecar(self) -> None:
+        seen = (bytes(self.seen_bitmap) if self.seen_bitmap is not None
+                else self.seen_sequences)
+        payload = pickle.dumps(
+            (os.fstat(self._fd).st_size, self.last_written_seq, seen),
+            protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = self._state_file.with_suffix(".state.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, self._state_file)
 
     def _recover_from_log(self) -> None:
         if not self.log_file.exists():
             self.expected_seq = 0
             return
 
-        max_seq = -1
-
-        try:
-            with self.log_file.open("r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
+        if self._load_sidecar():
+            return
 
-                    parts = line.split(",", 3)
-                    if len(parts) < 4:
-                        continue
+        seqs: list[int] = []
 
+        # Zero-copy scan: map the file and let one compiled regex sweep
+        # pull out every sequence prefix, instead of materializing the
+        # whole log as a bytes object and splitting it (an empty file
+        # cannot be mapped, hence the size check)
+        try:
+            with self.log_file.open("rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size > 0:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
                     try:
-                        seq = int(parts[0])
-                    except ValueError:
-                        continue
-
-                    self.seen_sequences.add(seq)
-                    if seq > max_seq:
-                        max_seq = seq
+                        seqs = [int(m.group(1)) for m in _LOG_SEQ_RE.finditer(mm)]
+                    finally:
+                        mm.close()
         except OSError:
-            self.seen_sequences = set()
-            max_seq = -1
+            seqs = []
 
-        self.last_written_seq = max_seq
+        self._mark_seen_bulk(seqs)
+        self.last_written_seq = max(seqs, default=-1)
         self.expected_seq = self.last_written_seq + 1
         self.gap_wait = 0
 
+        # Seed the incremental gap count with the holes already behind the
+        # recovered write frontier
+        if self.last_written_seq >= 0:
+            self.stats.gaps = (self.last_written_seq + 1) - self._seen_count()
+
     def _request_retransmit(self, seq: int) -> None:
-        if seq < 0:
-            return
-        if seq in self.seen_sequences:
+        # Guards ordered by cost: pending_retransmits is the smallest set
+        # and catches repeat requests for the same gap, the seen check
+        # covers already-logged sequences, and the sign check almost
+        # never fires
+        if seq in self.pending_retransmits or seq < 0:
             return
-        if seq in self.pending_retransmits:
+        bm = self.seen_bitmap
+        if bm is not None and seq < len(bm):
+            if bm[seq]:
+                return
+        elif seq in self.seen_sequences:
             return
 
-        self.source.request_retransmit(seq)
+        self._retransmit_batch.add(seq)
         self.pending_retransmits.add(seq)
-        self.stats.retransmit_requests += 1
+
+    def _drain_retransmits(self) -> None:
+        """Send the requests batched by _request_retransmit in one locked
+        pass (the source has no batch API, so it is one call per sequence
+        but a single lock acquisition)."""
+        batch = self._retransmit_batch
+        if not batch:
+            return
+        with self._source_lock:
+            request = self.source.request_retransmit
+            for s in batch:
+                request(s)
+        self.stats.retransmit_requests += len(batch)
+        batch.clear()
 
     def _append_packet(self, pkt: Packet) -> None:
+        # Each relation is computed exactly once; everything below branches
+        # on the flags instead of re-testing set membership or the frontier
         seq = pkt.sequence
-        status = "OK"
-
-        if seq in self.pending_retransmits:
-            status = "RETRANSMIT"
+        pending = self.pending_retransmits
+        stats = self.stats
+        last = self.last_written_seq
+
+        is_pending = seq in pending
+        is_late = seq < last
+        status = "RETRANSMIT" if is_pending else ("LATE" if is_late else "OK")
+
+        # Keep the gap count current: jumping past the frontier opens
+        # holes, a late write behind it fills one (writes are always of
+        # unseen sequences, so a late seq is a hole by construction)
+        if is_late:
+            stats.inversions += 1
+            stats.gaps -= 1
+        elif seq > last + 1:
+            stats.gaps += seq - (last + 1)
+
+        self._pending_lines.append(
+            _LINE_FMT % (seq, pkt.timestamp, pkt.payload.hex(), status))
+
+        bm = self.seen_bitmap
+        if bm is not None and 0 <= seq < len(bm):
+            bm[seq] = 1
         else:
-            if seq < self.last_written_seq:
-                status = "LATE"
-
-        if seq < self.last_written_seq:
-            self.stats.inversions += 1
-
-        line = f"{seq},{pkt.timestamp},{pkt.payload.hex()},{status}\n"
-
-        self.log_file.parent.mkdir(parents=True, exist_ok=True)
-        with self.log_file.open("a", encoding="utf-8") as f:
-            f.write(line)
-            f.flush()
-
-        self.seen_sequences.add(seq)
-        if seq > self.last_written_seq:
+            self.seen_sequences.add(seq)
+        if seq > last:
             self.last_written_seq = seq
+        if is_pending:
+            pending.remove(seq)
+
+        stats.packets_written += 1
+
+
+def analyze_log(path: Path) -> tuple[set[int], int, int, int]:
+    """Collect the unique sequences and the OK/LATE/RETRANSMIT counts of a
+    log in a single mapped pass.
+
+    The log is append-only, so anything that previously read it once for
+    sequences and again for statuses can call this instead and pay for one
+    read.
+
+    Returns:
+        (sequences, ok_count, late_count, retransmit_count)
+    """
+    seqs: set[int] = set()
+    ok = late = retransmit = 0
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return seqs, ok, late, retransmit
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for m in _LOG_LINE_RE.finditer(mm):
+                    seqs.add(int(m.group(1)))
+                    status = m.group(2)
+                    if status == b"OK":
+                        ok += 1
+                    elif status == b"LATE":
+                        late += 1
+                    else:
+                        retransmit += 1
+            finally:
+                mm.close()
+    except OSError:
+        pass
+    return seqs, ok, late, retransmit
 
-        if seq in self.pending_retransmits:
-            self.pending_retransmits.remove(seq)
-
-        self.stats.packets_written += 1
-
-    def _compute_gaps(self) -> int:
-        if self.last_written_seq < 0:
-            return 0
-
-        upper = self.last_written_seq
-        total_packets = getattr(self.source, "total_packets", None)
-        if isinstance(total_packets, int) and total_packets > 0:
-            upper = max(upper, total_packets - 1)
-
-        gaps = 0
-        for s in range(0, upper + 1):
-            if s not in self.seen_sequences:
-                gaps += 1
-        return gaps